@@ -1,7 +1,11 @@
+import os
+
 from flask import Flask
+from jinja2 import FileSystemBytecodeCache
 
+from app.mail import SMTPMailer
 from app.config import config, Config
-from app.database import Base, engine
+from app.database import init_db, close_db
 
 def create_app(config_name='default'):
     app = Flask(__name__,
@@ -22,11 +26,32 @@ def create_app(config_name='default'):
     # load SECRET_KEY from environment variable
     app.config['SECRET_KEY'] = Config.SECRET_KEY
 
-    # Import models to ensure they're registered with Base
-    from app.models import User, Quiz, Result, Settings
+    # Outside development, templates never change on disk: skip the
+    # per-render mtime check and keep compiled templates across restarts
+    if not app.debug:
+        app.config['TEMPLATES_AUTO_RELOAD'] = False
+        app.jinja_env.auto_reload = False
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+
+    # Create database tables on startup only when configured to; otherwise
+    # use `flask init-db` or init_db.py once per deployment
+    if app.config.get('INIT_DB'):
+        init_db()
+
+    # Make sure the quiz upload folder exists once, not on every upload
+    os.makedirs(Config.QUESTIONS_DIR, exist_ok=True)
 
-    # Create database tables
-    Base.metadata.create_all(bind=engine)
+    # One mailer per app; each email worker thread reuses its own SMTP connection
+    app.extensions['mailer'] = SMTPMailer()
+
+    # Close the request's DB session (if any) when the app context ends
+    app.teardown_appcontext(close_db)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create all database tables."""
+        init_db()
+        print("✅ Database tables created successfully!")
 
     # Register blueprints
     from app.blueprints.auth import auth
@@ -48,4 +73,9 @@ def create_app(config_name='default'):
         # Return formatted string directly or datetime object (Jinja handles objects well if chained)
         return pkt_time
 
+    # Compile every template up front so the first requests don't pay for it
+    if not app.debug:
+        for template_name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(template_name)
+
     return app
@@ -1,31 +1,39 @@
 import os
+import hmac
 import json
+import time
+import orjson
 
-from functools import wraps
-from flask import Blueprint, render_template, request, redirect, url_for, session
+from itertools import groupby
+from collections import defaultdict
+from sqlalchemy import exists
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload
+from flask import Blueprint, render_template, request, redirect, url_for, session, current_app
+from werkzeug.utils import secure_filename
 
 from app.config import Config
-from app.database import SessionLocal
+from app.database import get_db
 from app.models import User, Quiz, Result
-from app.utils import get_or_create_settings, load_quiz_by_id, is_smtp_enabled, get_max_attempts
+from app.tasks import enqueue, send_quiz_notifications
+from app.utils import get_or_create_settings, clear_settings_cache, clear_user_cache, load_quiz_by_id, is_smtp_enabled, hash_password, render_cached_template
 
 admin = Blueprint('admin', __name__, url_prefix='/admin')
 
-def with_db(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        db = SessionLocal()
-        try:
-            return f(db, *args, **kwargs)
-        finally:
-            db.close()
-    return decorated_function
+SCORES_PER_PAGE = 50  # Students shown per page on the scores screen
+
+
+@admin.before_request
+def require_admin():
+    """Redirect non-admins to the login page before any route work is done"""
+    if request.endpoint != "admin.admin_login" and session.get("role") != "admin":
+        return redirect(url_for("admin.admin_login"))
+
 
 # SEE NEXT COMMENT FOR ROUTES - File is too large for single creation
 # Copy remaining routes from main.py admin sections
 @admin.route("/login", methods=["GET", "POST"])
-@with_db
-def admin_login(db):
+def admin_login():
     """Admin login page and handler"""
     
     if session.get("role") == "admin":
@@ -34,10 +42,18 @@ def admin_login(db):
         return redirect(url_for("user.user_history"))
     
     if request.method == "POST":
-        username = request.form.get("username")
-        password = request.form.get("password")
+        username = request.form.get("username", "")
+        password = request.form.get("password", "")
+
+        # Compare both fields in constant time, and always both, so response
+        # timing doesn't reveal which part (or how much of it) was right
+        username_ok = hmac.compare_digest(username.encode(), (Config.ADMIN_USERNAME or "").encode())
+        password_ok = hmac.compare_digest(password.encode(), (Config.ADMIN_PASSWORD or "").encode())
+        credentials_configured = bool(Config.ADMIN_USERNAME and Config.ADMIN_PASSWORD)
+
+        if username_ok & password_ok & credentials_configured:
+            db = get_db()
 
-        if username == Config.ADMIN_USERNAME and password == Config.ADMIN_PASSWORD:
             # Check if admin user exists in DB, if not create it
             admin_user = db.query(User).filter(User.username == Config.ADMIN_USERNAME, User.role == "admin").first()
             if not admin_user:
@@ -53,16 +69,13 @@ def admin_login(db):
 
         return render_template("admin/login.html", error="Invalid credentials")
 
-    return render_template("admin/login.html", error=None)
+    return render_cached_template("admin/login.html", error=None)
 
 
 @admin.route("/dashboard")
-@with_db
-def admin_dashboard(db):
+def admin_dashboard():
     """Admin dashboard"""
-    # Check if user is admin
-    if session.get("role") != "admin":
-        return redirect(url_for("admin.admin_login"))
+    db = get_db()
 
     message = session.pop("message", None)
 
@@ -71,8 +84,8 @@ def admin_dashboard(db):
         total_quizzes = db.query(Quiz).count()
         total_users = db.query(User).filter(User.role == "user").count()
         total_submissions = db.query(Result).count()
-    except Exception as e:
-        print(f"Error calculating stats: {str(e)}")
+    except SQLAlchemyError:
+        current_app.logger.exception("Error calculating dashboard stats")
         total_quizzes = 0
         total_users = 0
         total_submissions = 0
@@ -85,18 +98,15 @@ def admin_dashboard(db):
 
 
 @admin.route("/quizzes")
-@with_db
-def admin_quizzes(db):
+def admin_quizzes():
     """Manage quizzes page"""
-    # Check if user is admin
-    if session.get("role") != "admin":
-        return redirect(url_for("admin.admin_login"))
+    db = get_db()
 
     try:
         # Get all quizzes
         quizzes = db.query(Quiz).order_by(Quiz.created_at.desc()).all()
-    except Exception as e:
-        print(f"Database error: {str(e)}")
+    except SQLAlchemyError:
+        current_app.logger.exception("Database error")
         quizzes = []
         session["message"] = "Database error. Please ensure the database is initialized."
 
@@ -105,13 +115,8 @@ def admin_quizzes(db):
 
 
 @admin.route("/quiz/upload", methods=["POST"])
-@with_db
-def upload_quiz(db):
+def upload_quiz():
     """Handle quiz file upload"""
-    # Check if user is admin
-    if session.get("role") != "admin":
-        return redirect(url_for("admin.admin_login"))
-
     try:
         file = request.files.get('file')
 
@@ -119,88 +124,54 @@ def upload_quiz(db):
             session["message"] = "No file selected"
             return redirect(url_for("admin.admin_quizzes"))
 
-        # Read and parse JSON
-        content = file.read()
-        quiz_data = json.loads(content)
+        # Accept the same encodings json.loads does (UTF-8 with or without
+        # a BOM, UTF-16, UTF-32); orjson only takes plain UTF-8
+        raw = file.stream.read()
+        encoding = json.detect_encoding(raw)
+        content = raw if encoding == "utf-8" else raw.decode(encoding).encode()
+        quiz_data = orjson.loads(content)
 
         # Validate JSON structure
-        required_keys = ["title"]
-        if not all(key in quiz_data for key in required_keys):
+        required_keys = {"title"}
+        if not required_keys.issubset(quiz_data):
             session["message"] = "Invalid quiz format - must have 'title' field"
             return redirect(url_for("admin.admin_quizzes"))
 
-        # Generate unique filename
-        import time
-        filename = f"quiz_{int(time.time())}_{file.filename}"
+        # Generate unique filename, keeping only a safe form of the uploaded name
+        filename = f"quiz_{time.time_ns()}_{secure_filename(file.filename)}"
 
-        # Save to questions folder (app/data/questions)
-        # Get app directory (parent of blueprints directory)
-        app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        questions_dir = os.path.join(app_dir, "data", "questions")
-        os.makedirs(questions_dir, exist_ok=True)
-        quiz_path = os.path.join(questions_dir, filename)
-        with open(quiz_path, "w", encoding="utf-8") as f:
-            json.dump(quiz_data, f, indent=2)
+        # Save the validated UTF-8 bytes to the questions folder (app/data/questions)
+        quiz_path = os.path.join(Config.QUESTIONS_DIR, filename)
+        with open(quiz_path, "wb") as f:
+            f.write(content)
 
-        # Create Quiz record in database
+        # Create Quiz record in database only once the file is on disk,
+        # keeping the transaction to a single short INSERT
+        db = get_db()
         new_quiz = Quiz(
             title=quiz_data["title"],
             filename=filename
         )
         db.add(new_quiz)
-        db.commit()
-        db.refresh(new_quiz)  # Refresh to get the new quiz ID
+        try:
+            db.flush()  # Assigns the new quiz ID
+            quiz_id = new_quiz.id
+            db.commit()
+        except Exception:
+            db.rollback()
+            os.remove(quiz_path)
+            raise
 
-        # Send email notification to all students about new quiz
-        email_count = 0
+        # Notify students about the new quiz in the background
         if is_smtp_enabled(db):
-            from app.mail import SMTPMailer
-            from app.config import Config
-
-            # Get all students with email addresses
-            students = db.query(User).filter(
-                User.role == "user",
-                User.email.isnot(None),
-                User.email != ""
-            ).all()
-
-            if students:
-                mailer = SMTPMailer()
-
-                # Get max attempts setting
-                max_attempts = get_max_attempts(db)
-
-                # Prepare email context
-                email_context = {
-                    'quiz_title': quiz_data['title'],
-                    'quiz_id': new_quiz.id,
-                    'max_attempts': max_attempts,
-                    'base_url': Config.BASE_URL
-                }
-
-                # Send email to each student
-                for student in students:
-                    try:
-                        success = mailer.send_template(
-                            to_email=student.email,
-                            subject=f"New Quiz Available: {quiz_data['title']}",
-                            template_name='student_quiz_reminder',
-                            context=email_context
-                        )
-                        if success:
-                            email_count += 1
-                    except Exception as e:
-                        print(f"Failed to send email to {student.email}: {str(e)}")
-
-                session["message"] = f"Quiz '{quiz_data['title']}' uploaded successfully! Email notifications sent to {email_count} student(s)."
-            else:
-                session["message"] = f"Quiz '{quiz_data['title']}' uploaded successfully! (No students with email addresses)"
+            enqueue(send_quiz_notifications, quiz_id)
+            session["message"] = f"Quiz '{quiz_data['title']}' uploaded successfully! Email notifications to students have been queued."
         else:
             session["message"] = f"Quiz '{quiz_data['title']}' uploaded successfully!"
 
         return redirect(url_for("admin.admin_quizzes"))
 
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         session["message"] = "Invalid JSON file"
         return redirect(url_for("admin.admin_quizzes"))
     except Exception as e:
@@ -209,25 +180,18 @@ def upload_quiz(db):
 
 
 @admin.route("/quiz/delete/<int:quiz_id>", methods=["POST"])
-@with_db
-def delete_quiz(db, quiz_id):
+def delete_quiz(quiz_id):
     """Delete a quiz and its submissions"""
-    # Check if user is admin
-    if session.get("role") != "admin":
-        return redirect(url_for("admin.admin_login"))
+    db = get_db()
 
-    quiz = db.query(Quiz).filter(Quiz.id == quiz_id).first()
+    quiz = db.get(Quiz, quiz_id)
     if quiz:
         # Delete quiz file from app/data/questions
-        app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        quiz_path = os.path.join(app_dir, "data", "questions", quiz.filename)
+        quiz_path = os.path.join(Config.QUESTIONS_DIR, quiz.filename)
         if os.path.exists(quiz_path):
             os.remove(quiz_path)
 
-        # Delete all results for this quiz
-        db.query(Result).filter(Result.quiz_id == quiz_id).delete()
-
-        # Delete quiz from database
+        # Delete quiz from database (its results cascade in the database)
         db.delete(quiz)
         db.commit()
 
@@ -239,52 +203,56 @@ def delete_quiz(db, quiz_id):
 
 
 @admin.route("/scores")
-@with_db
-def view_scores(db):
-    """View all user scores"""
-    # Check if user is admin
-    if session.get("role") != "admin":
-        return redirect(url_for("admin.admin_login"))
+def view_scores():
+    """View user scores, a page of students at a time"""
+    db = get_db()
+    page = max(request.args.get("page", 1, type=int), 1)
+    has_next = False
 
     try:
-        # Get all users (excluding admin)
-        users = db.query(User).filter(User.role == "user").order_by(User.user_id).all()
+        # Get this page's students that have submitted at least once;
+        # the extra row only tells whether another page follows
+        users = db.query(User).filter(
+            User.role == "user",
+            User.results.any()
+        ).order_by(User.user_id).offset((page - 1) * SCORES_PER_PAGE).limit(SCORES_PER_PAGE + 1).all()
+        has_next = len(users) > SCORES_PER_PAGE
+        users = users[:SCORES_PER_PAGE]
+        has_students = bool(users) or db.query(exists().where(User.role == "user")).scalar()
+
+        # Stream these students' results in one query, with the same stored
+        # attempt numbers the students see on their own pages
+        user_results = db.query(
+            Result.id, Result.user_id, Result.quiz_id, Result.score, Result.submitted_at,
+            Result.attempt_number, Quiz.title.label("quiz_title")
+        ).join(Result.quiz).filter(
+            Result.user_id.in_([user.id for user in users])
+        ).order_by(Result.user_id, Result.quiz_id, Result.submitted_at).yield_per(500)
+
+        # Group results by user, then by quiz
+        quiz_groups_by_user = defaultdict(dict)
+        for (user_id, quiz_id), attempts in groupby(user_results, key=lambda r: (r.user_id, r.quiz_id)):
+            attempts = list(attempts)
+            quiz_groups_by_user[user_id][quiz_id] = {
+                'quiz_title': attempts[0].quiz_title,
+                'attempts': attempts
+            }
 
-        # For each user, group their submissions by quiz
         for user in users:
-            user_results = db.query(Result).filter(Result.user_id == user.id).order_by(Result.quiz_id, Result.submitted_at).all()
-
-            # Group results by quiz
-            quiz_groups = {}
-            for result in user_results:
-                quiz_id = result.quiz_id
-                if quiz_id not in quiz_groups:
-                    quiz_groups[quiz_id] = {
-                        'quiz': result.quiz,
-                        'attempts': []
-                    }
-                quiz_groups[quiz_id]['attempts'].append(result)
-
-            # Add attempt numbers to each result
-            for quiz_id, group in quiz_groups.items():
-                for idx, result in enumerate(group['attempts'], start=1):
-                    result.attempt_number = idx
-
-            user.quiz_groups = quiz_groups
+            user.quiz_groups = quiz_groups_by_user.get(user.id, {})
 
-    except Exception as e:
-        print(f"Database error: {str(e)}")
+    except SQLAlchemyError:
+        current_app.logger.exception("Database error")
         users = []
+        has_students = False
 
-    return render_template("admin/scores.html", users=users)
+    return render_template("admin/scores.html", users=users, has_students=has_students,
+                           page=page, has_next=has_next)
 
 @admin.route("/quiz/preview/<int:quiz_id>")
-@with_db
-def admin_quiz_preview(db, quiz_id):
+def admin_quiz_preview(quiz_id):
     """Preview a quiz with correct answers"""
-    # Check if user is admin
-    if session.get("role") != "admin":
-        return redirect(url_for("admin.admin_login"))
+    db = get_db()
 
     # Load quiz
     quiz, quiz_data = load_quiz_by_id(quiz_id, db)
@@ -294,23 +262,16 @@ def admin_quiz_preview(db, quiz_id):
     return render_template("admin/quiz_preview.html", exam=quiz_data)
 
 @admin.route("/quizzes/delete-all", methods=["POST"])
-@with_db
-def admin_delete_all_quizzes(db):
+def admin_delete_all_quizzes():
     """Delete all quizzes"""
-    # Check if user is admin
-    if session.get("role") != "admin":
-        return redirect(url_for("admin.admin_login"))
+    db = get_db()
 
     # Delete all quiz files
     quizzes = db.query(Quiz).all()
     
-    # Get questions directory
-    app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    questions_dir = os.path.join(app_dir, "data", "questions")
-    
     for quiz in quizzes:
         if quiz.filename:
-            file_path = os.path.join(questions_dir, quiz.filename)
+            file_path = os.path.join(Config.QUESTIONS_DIR, quiz.filename)
             try:
                 if os.path.exists(file_path):
                     os.remove(file_path)
@@ -318,9 +279,8 @@ def admin_delete_all_quizzes(db):
             except Exception as e:
                 print(f"Error deleting file {quiz.filename}: {str(e)}")
 
-    # Delete all quizzes and associated results
-    db.query(Result).delete()
-    db.query(Quiz).delete()
+    # Delete all quizzes and associated results (cascaded by the database)
+    db.query(Quiz).delete(synchronize_session=False)
     db.commit()
 
     session["message"] = "All quizzes deleted successfully!"
@@ -328,20 +288,16 @@ def admin_delete_all_quizzes(db):
 
 
 @admin.route("/submission/<int:result_id>")
-@with_db
-def admin_view_submission(db, result_id):
+def admin_view_submission(result_id):
     """View a specific user's submission"""
-    # Check if user is admin
-    if session.get("role") != "admin":
-        return redirect(url_for("admin.admin_login"))
+    db = get_db()
 
-    # Get result from database
-    result = db.query(Result).filter(Result.id == result_id).first()
+    # Get result from database, with its student and quiz in the same query
+    result = db.get(Result, result_id, options=[joinedload(Result.user), joinedload(Result.quiz)])
     if not result:
         return redirect(url_for("admin.view_scores"))
 
-    # Parse results from JSON
-    results = json.loads(result.answers)
+    results = result.answers
 
     # Get quiz title from relationship
     exam_title = result.quiz.title if result.quiz else "Exam"
@@ -356,15 +312,12 @@ def admin_view_submission(db, result_id):
 
 
 @admin.route("/submissions/delete-all", methods=["POST"])
-@with_db
-def admin_delete_all_submissions(db):
+def admin_delete_all_submissions():
     """Delete all student submissions"""
-    # Check if user is admin
-    if session.get("role") != "admin":
-        return redirect(url_for("admin.admin_login"))
+    db = get_db()
 
     # Delete all results
-    db.query(Result).delete()
+    db.query(Result).delete(synchronize_session=False)
     db.commit()
 
     session["message"] = "All submissions deleted successfully!"
@@ -372,18 +325,15 @@ def admin_delete_all_submissions(db):
 
 
 @admin.route("/users")
-@with_db
-def admin_users(db):
+def admin_users():
     """Manage users page"""
-    # Check if user is admin
-    if session.get("role") != "admin":
-        return redirect(url_for("admin.admin_login"))
+    db = get_db()
 
     try:
         # Get all users (excluding admin)
         users = db.query(User).filter(User.role == "user").order_by(User.user_id).all()
-    except Exception as e:
-        print(f"Database error: {str(e)}")
+    except SQLAlchemyError:
+        current_app.logger.exception("Database error")
         users = []
         session["message"] = "Database error. Please ensure the database is initialized."
 
@@ -392,20 +342,21 @@ def admin_users(db):
 
 
 @admin.route("/users/add", methods=["POST"])
-@with_db
-def admin_add_user(db):
+def admin_add_user():
     """Add a new user"""
-    # Check if user is admin
-    if session.get("role") != "admin":
-        return redirect(url_for("admin.admin_login"))
+    db = get_db()
 
     user_id = request.form.get("user_id")
     password = request.form.get("password")
     email = request.form.get("email")
 
+    if not user_id or not password:
+        session["message"] = "User ID and password are required!"
+        return redirect(url_for("admin.admin_users"))
+
     # Check if user already exists
-    existing_user = db.query(User).filter(User.user_id == user_id).first()
-    if existing_user:
+    user_exists = db.query(exists().where(User.user_id == user_id)).scalar()
+    if user_exists:
         session["message"] = f"User with ID {user_id} already exists!"
         return redirect(url_for("admin.admin_users"))
 
@@ -413,7 +364,7 @@ def admin_add_user(db):
     new_user = User(
         username=f"Student_{user_id}",
         user_id=user_id,
-        password=password,
+        password=hash_password(password),
         email=email,
         role="user"
     )
@@ -425,12 +376,9 @@ def admin_add_user(db):
 
 
 @admin.route("/users/edit", methods=["POST"])
-@with_db
-def admin_edit_user(db):
+def admin_edit_user():
     """Edit a user"""
-    # Check if user is admin
-    if session.get("role") != "admin":
-        return redirect(url_for("admin.admin_login"))
+    db = get_db()
 
     user_db_id = request.form.get("user_db_id", type=int)
     user_id = request.form.get("user_id")
@@ -444,84 +392,67 @@ def admin_edit_user(db):
         return redirect(url_for("admin.admin_users"))
 
     # Check if new user_id conflicts with another user
-    existing_user = db.query(User).filter(User.user_id == user_id, User.id != user_db_id).first()
-    if existing_user:
+    user_id_taken = db.query(exists().where(User.user_id == user_id, User.id != user_db_id)).scalar()
+    if user_id_taken:
         session["message"] = f"User ID {user_id} is already taken!"
         return redirect(url_for("admin.admin_users"))
 
     # Update user
     user.user_id = user_id
-    user.password = password
+    if password:  # A blank password keeps the current one
+        user.password = hash_password(password)
     user.email = email
     user.username = f"Student_{user_id}"
     db.commit()
+    clear_user_cache(user.id)
 
     session["message"] = f"User {user_id} updated successfully!"
     return redirect(url_for("admin.admin_users"))
 
 
 @admin.route("/users/delete/<int:user_db_id>", methods=["POST"])
-@with_db
-def admin_delete_user(db, user_db_id):
+def admin_delete_user(user_db_id):
     """Delete a user and their submissions"""
-    # Check if user is admin
-    if session.get("role") != "admin":
-        return redirect(url_for("admin.admin_login"))
+    db = get_db()
 
     # Get user
-    user = db.query(User).filter(User.id == user_db_id).first()
+    user = db.get(User, user_db_id)
     if not user:
         session["message"] = "User not found!"
         return redirect(url_for("admin.admin_users"))
 
-    # Delete user's results first
-    db.query(Result).filter(Result.user_id == user_db_id).delete()
-
-    # Delete user
+    # Delete user (their results cascade in the database)
     db.delete(user)
     db.commit()
+    clear_user_cache(user_db_id)
 
     session["message"] = "User deleted successfully!"
     return redirect(url_for("admin.admin_users"))
 
 
 @admin.route("/settings", methods=["GET"])
-@with_db
-def admin_settings(db):
+def admin_settings():
     """Admin settings page"""
-    # Check if user is admin
-    if session.get("role") != "admin":
-        return redirect(url_for("admin.admin_login"))
+    db = get_db()
 
     # Get current settings
     settings = get_or_create_settings(db)
 
-    # Check SMTP configuration
-    smtp_configured = all([
-        Config.EMAIL_USERNAME,
-        Config.EMAIL_PASSWORD,
-        Config.EMAIL_HOST,
-        Config.EMAIL_FROM
-    ])
-
     # Get message from session if available
     message = session.pop("message", None)
 
     return render_template(
         "admin/settings.html",
         settings=settings,
-        smtp_configured=smtp_configured,
+        smtp_configured=Config.SMTP_CONFIGURED,
         message=message
     )
 
 
 @admin.route("/settings/update", methods=["POST"])
-@with_db
-def admin_settings_update(db):
+def admin_settings_update():
     """Update admin settings"""
-    # Check if user is admin
-    if session.get("role") != "admin":
-        return redirect(url_for("admin.admin_login"))
+    db = get_db()
 
     # Get form data
     max_attempts = request.form.get("max_attempts", type=int)
@@ -535,13 +466,7 @@ def admin_settings_update(db):
 
     # Check SMTP configuration if enabling SMTP
     if smtp_enabled:
-        smtp_configured = all([
-            Config.EMAIL_USERNAME,
-            Config.EMAIL_PASSWORD,
-            Config.EMAIL_HOST,
-            Config.EMAIL_FROM
-        ])
-        if not smtp_configured:
+        if not Config.SMTP_CONFIGURED:
             session["message"] = "Warning: SMTP enabled but credentials are not fully configured in .env file!"
 
     # Update settings
@@ -550,6 +475,7 @@ def admin_settings_update(db):
     settings.smtp_enabled = smtp_enabled
     settings.full_page_submission = full_page_submission
     db.commit()
+    clear_settings_cache()
 
     session["message"] = "Settings updated successfully!"
     return redirect(url_for("admin.admin_settings"))
@@ -1,4 +1,6 @@
-from flask import Blueprint, render_template, session, redirect, url_for
+from flask import Blueprint, session, redirect, url_for, g
+
+from app.utils import render_cached_template
 
 auth = Blueprint('auth', __name__)
 
@@ -14,11 +16,12 @@ def index():
     if session.get("role") == "user":
         return redirect(url_for("user.user_history"))
         
-    return render_template("index.html")
+    return render_cached_template("index.html")
 
 
 @auth.route("/logout")
 def logout():
     """Logout user"""
     session.clear()
+    g.pop("current_user", None)
     return redirect(url_for("auth.index"))
@@ -1,29 +1,41 @@
-import json
-
-from functools import wraps
-from datetime import datetime
-from flask import Blueprint, render_template, request, redirect, url_for, session
-
-from app.mail import SMTPMailer
-from app.database import SessionLocal
+from datetime import datetime, timedelta
+from collections import defaultdict
+from flask import Blueprint, render_template, request, redirect, url_for, session, g
+from sqlalchemy import exists
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import defer, joinedload
+
+from app.config import Config
+from app.database import get_db
+from app.tasks import enqueue, send_submission_notification
 from app.models import User, Quiz, Result
-from app.utils import get_current_user, get_max_attempts, is_smtp_enabled, load_quiz_by_id, calculate_score, get_or_create_settings
+from app.utils import get_current_user, clear_user_cache, get_attempt_summary, get_max_attempts, is_smtp_enabled, load_quiz_by_id, calculate_score, is_full_page_submission, verify_password
 
 user = Blueprint('user', __name__, url_prefix='/user')
 
-def with_db(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        db = SessionLocal()
-        try:
-            return f(db, *args, **kwargs)
-        finally:
-            db.close()
-    return decorated_function
+# Login error messages
+STUDENT_ID_REQUIRED = "Student ID is required"
+PASSWORD_REQUIRED = "Password is required"
+INVALID_CREDENTIALS = "Invalid credentials. Please contact your administrator."
+
+
+@user.before_request
+def require_user():
+    """Redirect anyone not logged in as a student before any route work is done"""
+    if request.endpoint == "user.user_register":
+        return None
+    if session.get("role") != "user":
+        return redirect(url_for("user.user_register"))
+    if not get_current_user(get_db()):
+        # The student was deleted; drop the stale login so the login page
+        # doesn't send them straight back here
+        session.clear()
+        g.pop("current_user", None)
+        return redirect(url_for("user.user_register"))
+
 
 @user.route("/register", methods=["GET", "POST"])
-@with_db
-def user_register(db):
+def user_register():
     """User registration/login page and handler"""
 
     if session.get("role") == "admin":
@@ -33,28 +45,28 @@ def user_register(db):
 
     if request.method == "POST":
         user_id = request.form.get("user_id", "").strip()
-        password = request.form.get("password", "").strip()
+        # Passwords are compared exactly as typed; whitespace may be part of them
+        password = request.form.get("password", "")
 
-        if not user_id or len(user_id) == 0:
-            return render_template("user/register.html", error="Student ID is required")
+        if not user_id:
+            return render_template("user/register.html", error=STUDENT_ID_REQUIRED)
 
-        if not password or len(password) == 0:
-            return render_template("user/register.html", error="Password is required")
+        if not password:
+            return render_template("user/register.html", error=PASSWORD_REQUIRED)
 
         # Check if user exists (only admin-created users can login)
+        db = get_db()
         user = db.query(User).filter(User.user_id == user_id, User.role == "user").first()
 
-        if not user:
-            # User doesn't exist - show error
-            return render_template("user/register.html", error="Invalid credentials. Please contact your administrator.")
-
-        # Verify password
-        if user.password != password:
-            return render_template("user/register.html", error="Invalid credentials. Please contact your administrator.")
+        # Verify password (also run for unknown IDs so both fail alike)
+        if not verify_password(user, password):
+            return render_template("user/register.html", error=INVALID_CREDENTIALS)
+        db.commit()  # Persist the upgraded hash for legacy plaintext passwords
 
         # Set session
         session["user_id"] = user.id
         session["role"] = "user"
+        g.pop("current_user", None)
 
         return redirect(url_for("user.user_history"))
 
@@ -62,34 +74,28 @@ def user_register(db):
 
 
 @user.route("/history")
-@with_db
-def user_history(db):
+def user_history():
     """Display user's quiz history"""
     try:
-        # Check if user is logged in
-        if session.get("role") != "user":
-            return redirect(url_for("user.user_register"))
-
-        # Get current user
+        # Logged-in student, already loaded by require_user
+        db = get_db()
         user = get_current_user(db)
-        if not user:
-            return redirect(url_for("user.user_register"))
 
-        # Get all quizzes with user's submissions
+        # Get all quizzes
         quizzes = db.query(Quiz).order_by(Quiz.created_at.desc()).all()
 
-        # For each quiz, attach user's submissions with attempt numbers
-        for quiz in quizzes:
-            user_submissions = [r for r in quiz.results if r.user_id == user.id]
-            # Sort by submission date
-            user_submissions.sort(key=lambda x: x.submitted_at)
-            # Add attempt numbers
-            for idx, submission in enumerate(user_submissions, start=1):
-                submission.attempt_number = idx
-            quiz.user_submissions = user_submissions
+        # Get all user's results (newest first), without decoding their answers
+        results = db.query(Result).options(defer(Result.answers)).filter(
+            Result.user_id == user.id
+        ).order_by(Result.submitted_at.desc()).all()
+
+        # Bucket the user's submissions by quiz, oldest first
+        submissions_by_quiz = defaultdict(list)
+        for submission in reversed(results):
+            submissions_by_quiz[submission.quiz_id].append(submission)
 
-        # Get all user's results
-        results = db.query(Result).filter(Result.user_id == user.id).order_by(Result.submitted_at.desc()).all()
+        for quiz in quizzes:
+            quiz.user_submissions = submissions_by_quiz.get(quiz.id, [])
 
         username = user.user_id if user.user_id else user.username
         return render_template("user/history.html", username=username, quizzes=quizzes, results=results)
@@ -101,35 +107,22 @@ def user_history(db):
 
 
 @user.route("/quiz/<int:quiz_id>")
-@with_db
-def take_quiz(db, quiz_id):
+def take_quiz(quiz_id):
     """Display quiz for user"""
     try:
-        # Check if user is logged in
-        if session.get("role") != "user":
-            return redirect(url_for("user.user_register"))
-
-        # Get current user
+        # Logged-in student, already loaded by require_user
+        db = get_db()
         user = get_current_user(db)
-        if not user:
-            return redirect(url_for("user.user_register"))
 
-        # Calculate attempt number for this quiz
-        attempt_count = db.query(Result).filter(
-            Result.user_id == user.id,
-            Result.quiz_id == quiz_id
-        ).count()
+        # Count this user's attempts at the quiz and find the latest in one query
+        attempt_count, latest_result_id, _ = get_attempt_summary(db, user.id, quiz_id)
 
         # Check if user has reached maximum attempts
         max_attempts = get_max_attempts(db)
         if attempt_count >= max_attempts:
             session["message"] = f"You have reached the maximum number of attempts ({max_attempts}) for this quiz!"
             # Redirect to their most recent result
-            latest_result = db.query(Result).filter(
-                Result.user_id == user.id,
-                Result.quiz_id == quiz_id
-            ).order_by(Result.submitted_at.desc()).first()
-            return redirect(url_for("user.view_result", result_id=latest_result.id))
+            return redirect(url_for("user.view_result", result_id=latest_result_id))
 
         attempt_number = attempt_count + 1
 
@@ -138,9 +131,7 @@ def take_quiz(db, quiz_id):
         if not quiz or not quiz_data:
             return "<h1>Quiz not found or unavailable.</h1>", 404
 
-        # Get settings
-        settings = get_or_create_settings(db)
-        full_page_submission = settings.full_page_submission
+        full_page_submission = is_full_page_submission(db)
 
         return render_template("user/quiz.html", exam=quiz_data, quiz_id=quiz_id, attempt_number=attempt_number, full_page_submission=full_page_submission)
     except Exception as e:
@@ -151,32 +142,23 @@ def take_quiz(db, quiz_id):
 
 
 @user.route("/submit/<int:quiz_id>", methods=["POST"])
-@with_db
-def submit_quiz(db, quiz_id):
+def submit_quiz(quiz_id):
     """Handle quiz submission"""
-    # Check if user is logged in
-    if session.get("role") != "user":
-        return redirect(url_for("user.user_register"))
-
-    # Get current user
+    # Logged-in student, already loaded by require_user
+    db = get_db()
     user = get_current_user(db)
-    if not user:
-        return redirect(url_for("user.user_register"))
+
+    # Count this user's attempts at the quiz and find the latest in one
+    # aggregate query; every check below works from it
+    attempt_count, latest_result_id, latest_submitted_at = get_attempt_summary(db, user.id, quiz_id)
 
     # DUPLICATE SUBMISSION PREVENTION: Check if user submitted this quiz very recently (within last 5 seconds)
-    from datetime import datetime, timedelta
     five_seconds_ago = datetime.utcnow() - timedelta(seconds=5)
-    recent_submission = db.query(Result).filter(
-        Result.user_id == user.id,
-        Result.quiz_id == quiz_id,
-        Result.submitted_at >= five_seconds_ago
-    ).first()
-
-    if recent_submission:
+    if latest_submitted_at and latest_submitted_at >= five_seconds_ago:
         # Duplicate submission detected - redirect to the recent result
         print(f"Duplicate submission prevented (5s check) for user {user.id} on quiz {quiz_id}")
         session["message"] = "Your quiz has already been submitted. Here are your results."
-        return redirect(url_for("user.view_result", result_id=recent_submission.id))
+        return redirect(url_for("user.view_result", result_id=latest_result_id))
 
     # ATTEMPT ID VALIDATION (Robust Check)
     # Check if we already have a result for this attempt number
@@ -184,163 +166,104 @@ def submit_quiz(db, quiz_id):
     if submitted_attempt_id:
         try:
             current_attempt_num = int(submitted_attempt_id)
-            existing_attempts_count = db.query(Result).filter(
-                Result.user_id == user.id,
-                Result.quiz_id == quiz_id
-            ).count()
             
             # If we are trying to submit attempt X, but we already have X (or more) results,
             # then this is a duplicate submission of an old form.
-            if current_attempt_num <= existing_attempts_count:
-                print(f"Stale submission prevented (Attempt {current_attempt_num} <= {existing_attempts_count}) for user {user.id}")
+            if attempt_count and current_attempt_num <= attempt_count:
+                print(f"Stale submission prevented (Attempt {current_attempt_num} <= {attempt_count}) for user {user.id}")
                 session["message"] = "This attempt has already been submitted."
                 
-                # Find the result corresponding to this attempt (or just the latest one)
-                # We'll just show the latest result to be safe
-                latest_result = db.query(Result).filter(
-                    Result.user_id == user.id,
-                    Result.quiz_id == quiz_id
-                ).order_by(Result.submitted_at.desc()).first()
-                
-                return redirect(url_for("user.view_result", result_id=latest_result.id))
+                # Show the latest result to be safe
+                return redirect(url_for("user.view_result", result_id=latest_result_id))
         except ValueError:
             pass # invalid attempt_id, ignore and proceed with normal logic
 
     # Check if user has reached maximum attempts
-    attempt_count = db.query(Result).filter(
-        Result.user_id == user.id,
-        Result.quiz_id == quiz_id
-    ).count()
-
     max_attempts = get_max_attempts(db)
     if attempt_count >= max_attempts:
         session["message"] = f"You have reached the maximum number of attempts ({max_attempts}) for this quiz!"
-        latest_result = db.query(Result).filter(
-            Result.user_id == user.id,
-            Result.quiz_id == quiz_id
-        ).order_by(Result.submitted_at.desc()).first()
-        return redirect(url_for("user.view_result", result_id=latest_result.id))
+        return redirect(url_for("user.view_result", result_id=latest_result_id))
 
     # Load quiz
     quiz, quiz_data = load_quiz_by_id(quiz_id, db)
     if not quiz or not quiz_data:
         return "<h1>Quiz not found.</h1>", 404
 
-    # Get form data
-    form_data = request.form
-    user_answers = dict(form_data)
-
-    # Calculate score
-    score, results = calculate_score(quiz_data, user_answers)
+    # Calculate score, reading answers straight from the submitted form
+    score, results, totals = calculate_score(quiz_data, request.form)
 
     # Calculate attempt number
     attempt_number = attempt_count + 1
 
-    # Send notification email to ADMIN when student submits quiz
-    email_sent = False
-    user_name = user.user_id if user.user_id else user.username
-
-    # Calculate total questions and correct count
-    total_questions = (
-        len(results.get('fill_in_the_blanks', [])) +
-        len(results.get('true_false', [])) +
-        len(results.get('mcqs', []))
-    )
-
-    correct_count = sum(
-        1 for section in results.values()
-        for item in section
-        if item.get('is_correct')
-    )
-
-    # Send email to admin if SMTP is enabled and admin email is configured
-    if is_smtp_enabled(db):
-        from app.config import Config
-
-        if Config.ADMIN_EMAIL:
-            # Prepare email context for admin notification
-            admin_email_context = {
-                'student_name': user_name,
-                'student_id': user.user_id if user.user_id else user.username,
-                'quiz_title': quiz.title,
-                'score': score,
-                'attempt_number': attempt_number,
-                'timestamp': datetime.now().strftime('%B %d, %Y at %I:%M %p'),
-                'passed': score >= 70,
-                'total_questions': total_questions,
-                'correct_count': correct_count,
-                'base_url': Config.BASE_URL
-            }
-
-            try:
-                mailer = SMTPMailer()
-                email_sent = mailer.send_template(
-                    to_email=Config.ADMIN_EMAIL,
-                    subject=f"Student Submission: {user_name} - {quiz.title}",
-                    template_name='admin_submission_notification',
-                    context=admin_email_context
-                )
-                if email_sent:
-                    print(f"Admin notification sent for {user_name}'s submission of {quiz.title}")
-            except Exception as e:
-                print(f"Failed to send admin notification: {str(e)}")
-                email_sent = False
-        else:
-            print(f"ADMIN_EMAIL not configured. No notification sent.")
-    else:
-        print(f"SMTP is disabled. No notification sent.")
-
-    # Save result to database with email_sent status
+    # Save result to database; the admin notification marks it as emailed
     result = Result(
         user_id=user.id,
         quiz_id=quiz_id,
         score=score,
-        answers=json.dumps(results),
-        email_sent=email_sent
+        attempt_number=attempt_number,
+        answers=results,
+        email_sent=False
     )
     db.add(result)
-    db.commit()
-    db.refresh(result)
+    try:
+        db.flush()  # Assigns the new result ID
+        result_id = result.id
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        # Tell a concurrent duplicate from a deleted student or quiz by
+        # looking at the data again rather than at the driver's message
+        duplicate = db.query(exists().where(
+            Result.user_id == user.id,
+            Result.quiz_id == quiz_id,
+            Result.attempt_number == attempt_number
+        )).scalar()
+        if not duplicate:
+            # Deleted while a cached copy of the user was still being served
+            clear_user_cache(user.id)
+            if not db.get(User, user.id):
+                session.clear()
+                g.pop("current_user", None)
+                return redirect(url_for("user.user_register"))
+            if not db.get(Quiz, quiz_id):
+                return "<h1>Quiz not found.</h1>", 404
+            raise
+
+        # A concurrent submission already saved this attempt number
+        print(f"Concurrent duplicate submission prevented for user {user.id} on quiz {quiz_id}")
+        _, latest_result_id, _ = get_attempt_summary(db, user.id, quiz_id)
+        if latest_result_id is None:
+            return redirect(url_for("user.user_history"))
+        session["message"] = "Your quiz has already been submitted. Here are your results."
+        return redirect(url_for("user.view_result", result_id=latest_result_id))
+
+    # Notify the admin in the background so the student isn't kept waiting on SMTP
+    if is_smtp_enabled(db) and Config.ADMIN_EMAIL:
+        enqueue(send_submission_notification, result_id, attempt_number, totals)
 
-    return redirect(url_for("user.view_result", result_id=result.id))
+    return redirect(url_for("user.view_result", result_id=result_id))
 
 
 @user.route("/result/<int:result_id>")
-@with_db
-def view_result(db, result_id):
+def view_result(result_id):
     """Display user's result by ID"""
-    # Check if user is logged in
-    if session.get("role") != "user":
-        return redirect(url_for("user.user_register"))
-
-    # Get current user
+    # Logged-in student, already loaded by require_user
+    db = get_db()
     user = get_current_user(db)
-    if not user:
-        return redirect(url_for("user.user_register"))
 
-    # Get result from database
-    result = db.query(Result).filter(Result.id == result_id, Result.user_id == user.id).first()
+    # Get result from database, with its quiz in the same query
+    result = db.query(Result).options(joinedload(Result.quiz)).filter(
+        Result.id == result_id, Result.user_id == user.id
+    ).first()
     if not result:
         return redirect(url_for("user.user_history"))
 
-    # Calculate attempt number for this result
-    all_attempts = db.query(Result).filter(
-        Result.user_id == user.id,
-        Result.quiz_id == result.quiz_id
-    ).order_by(Result.submitted_at).all()
-
-    attempt_number = None
-    for idx, attempt in enumerate(all_attempts, start=1):
-        if attempt.id == result.id:
-            attempt_number = idx
-            break
-
     # Check if user can retake (less than max attempts)
+    attempt_count, _, _ = get_attempt_summary(db, user.id, result.quiz_id)
     max_attempts = get_max_attempts(db)
-    can_retake = len(all_attempts) < max_attempts
+    can_retake = attempt_count < max_attempts
 
-    # Parse results from JSON
-    results = json.loads(result.answers)
+    results = result.answers
 
     # Get quiz title and ID from relationship
     exam_title = result.quiz.title if result.quiz else "Exam"
@@ -350,5 +273,5 @@ def view_result(db, result_id):
     message = session.pop("message", None)
 
     return render_template("user/result.html", score=result.score, results=results, exam_title=exam_title,
-                         attempt_number=attempt_number, quiz_id=quiz_id, can_retake=can_retake, message=message)
+                         attempt_number=result.attempt_number, quiz_id=quiz_id, can_retake=can_retake, message=message)
 
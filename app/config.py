@@ -18,6 +18,16 @@ class Config:
     basedir = os.path.abspath(os.path.dirname(__file__))
     instance_path = os.path.join(os.path.dirname(basedir), 'instance')
     SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(instance_path, 'quiz_app.db')}"
+
+    # Uploaded quiz files
+    QUESTIONS_DIR = os.path.join(basedir, 'data', 'questions')
+
+    # Database connection pool
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))  # Seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # Seconds before a connection is replaced
+    DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", 30))  # Seconds to wait on a locked database
     
     # Email configuration
     EMAIL_USERNAME = os.getenv("EMAIL_USERNAME")
@@ -25,17 +35,21 @@ class Config:
     EMAIL_HOST = os.getenv("EMAIL_HOST")
     EMAIL_PORT = int(os.getenv("EMAIL_PORT", 587))
     EMAIL_FROM = os.getenv("EMAIL_FROM")
+    SMTP_CONFIGURED = all([EMAIL_USERNAME, EMAIL_PASSWORD, EMAIL_HOST, EMAIL_FROM])
     BASE_URL = os.getenv("BASE_URL", "http://localhost:8080")
+    EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", 2))  # Background email threads per process
 
 
 class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
+    INIT_DB = True  # Create missing tables whenever the app starts
 
 
 class ProductionConfig(Config):
     """Production configuration"""
     DEBUG = False
+    INIT_DB = False  # Tables are created once with `flask init-db`
 
 
 # Config dictionary
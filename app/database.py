@@ -1,27 +1,67 @@
+import orjson
+
+from flask import g
 from app.config import Config
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 # SQLite database URL from config
 SQLALCHEMY_DATABASE_URL = Config.SQLALCHEMY_DATABASE_URI
 
-# Create engine
+# Create engine with a bounded connection pool shared by all requests
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": Config.DB_BUSY_TIMEOUT},
+    pool_size=Config.DB_POOL_SIZE,
+    max_overflow=Config.DB_MAX_OVERFLOW,
+    pool_timeout=Config.DB_POOL_TIMEOUT,
+    pool_recycle=Config.DB_POOL_RECYCLE,
+    pool_pre_ping=True,
+    # JSON columns are (de)serialized with orjson instead of the stdlib json
+    json_serializer=lambda obj: orjson.dumps(obj).decode(),
+    json_deserializer=orjson.loads
 )
 
+# SQLite leaves foreign keys unenforced unless enabled per connection;
+# Result rows rely on ON DELETE CASCADE to go away with their user/quiz.
+# WAL lets readers keep going while a request writes, and with it
+# synchronous=NORMAL only fsyncs at checkpoints instead of every commit.
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")  # 256MB
+    cursor.execute("PRAGMA cache_size=-65536")  # 64MB page cache
+    cursor.close()
+
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Create Base class
 Base = declarative_base()
 
-# Dependency to get DB session
+def init_db():
+    """Create all tables for the registered models"""
+    # Import models to ensure they're registered with Base
+    from app import models  # noqa: F401
+
+    Base.metadata.create_all(bind=engine)
+
+# Request-scoped DB session
 def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
+    """Get the DB session for the current request, opening it on first use"""
+    if 'db' not in g:
+        g.db = SessionLocal()
+    return g.db
+
+
+def close_db(exception=None):
+    """Close the current request's DB session, if one was opened"""
+    db = g.pop('db', None)
+    if db is not None:
         db.close()
@@ -1,4 +1,6 @@
+import time
 import smtplib
+import threading
 
 from app.config import Config
 from flask import render_template
@@ -8,7 +10,16 @@ from email.mime.multipart import MIMEMultipart
 
 
 class SMTPMailer:
-    """Reusable SMTP client for sending HTML + text emails."""
+    """Reusable SMTP client for sending HTML + text emails.
+
+    Each thread using this mailer (e.g. every background email worker)
+    keeps its own authenticated connection open between sends, so workers
+    deliver in parallel; a connection is re-established when the server
+    has dropped it.
+    """
+
+    # Check a connection with NOOP before reusing it after this many idle seconds
+    IDLE_CHECK_AFTER = 30
 
     def __init__(self):
         # Use configuration from Config class
@@ -18,6 +29,7 @@ class SMTPMailer:
         self.port = Config.EMAIL_PORT
         self.sender = Config.EMAIL_FROM
         self.base_url = Config.BASE_URL
+        self._local = threading.local()  # Per-thread open connection and last use time
 
     def create_message(self, to_email: str, subject: str, text: str, html: str) -> MIMEMultipart:
         """Create a multipart email message."""
@@ -30,21 +42,86 @@ class SMTPMailer:
         msg.attach(MIMEText(html, "html"))
         return msg
 
+    def connect(self) -> smtplib.SMTP:
+        """Open an authenticated SMTP connection."""
+        server = smtplib.SMTP(self.host, self.port)
+        try:
+            server.starttls()
+            server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def _ensure_connected(self) -> smtplib.SMTP:
+        """Return this thread's connection, reconnecting if it has gone away."""
+        local = self._local
+        server = getattr(local, "server", None)
+        if server is not None and time.monotonic() - getattr(local, "last_used", 0) > self.IDLE_CHECK_AFTER:
+            try:
+                if server.noop()[0] != 250:
+                    self._disconnect()
+            except (smtplib.SMTPException, OSError):
+                self._disconnect()
+
+        if getattr(local, "server", None) is None:
+            local.server = self.connect()
+            local.last_used = time.monotonic()
+        return local.server
+
+    def _disconnect(self):
+        """Close this thread's connection, if one is open."""
+        server = getattr(self._local, "server", None)
+        self._local.server = None
+        if server is not None:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                server.close()
+
+    def close(self):
+        """Close the calling thread's connection, if one is open."""
+        self._disconnect()
+
     def send(self, to_email: str, subject: str, text: str, html: str):
         """Send an email via SMTP."""
-        message = self.create_message(to_email, subject, text, html)
+        message = self.create_message(to_email, subject, text, html).as_string()
 
         try:
-            with smtplib.SMTP(self.host, self.port) as server:
-                server.starttls()
-                server.login(self.username, self.password)
-                server.sendmail(self.sender, to_email, message.as_string())
+            try:
+                self._ensure_connected().sendmail(self.sender, to_email, message)
+            except smtplib.SMTPServerDisconnected:
+                # Dropped since the last check; retry once on a fresh connection
+                self._disconnect()
+                self._ensure_connected().sendmail(self.sender, to_email, message)
+            self._local.last_used = time.monotonic()
             print(f"✅ Email successfully sent to {to_email}")
             return True
+        except smtplib.SMTPRecipientsRefused as e:
+            # Only this address was rejected; the connection is still usable
+            print(f"❌ Failed to send email to {to_email}: {e}")
+            return False
         except Exception as e:
+            # Any other failure may leave the connection mid-transaction,
+            # so the next send on this thread starts on a fresh one
+            self._disconnect()
             print(f"❌ Failed to send email to {to_email}: {e}")
             return False
 
+    def render(self, template_name: str, context: dict):
+        """Render the plain text and HTML bodies of an email template.
+
+        Returns:
+            tuple: (text, html)
+        """
+        # Add base_url to context if not already present
+        if 'base_url' not in context:
+            context['base_url'] = self.base_url
+
+        text = render_template(f'emails/{template_name}.txt', **context)
+        html = render_template(f'emails/{template_name}.html', **context)
+        return text, html
+
     def send_template(self, to_email: str, subject: str, template_name: str, context: dict):
         """Send an email using Flask templates.
 
@@ -58,15 +135,7 @@ class SMTPMailer:
             bool: True if email sent successfully, False otherwise
         """
         try:
-            # Add base_url to context if not already present
-            if 'base_url' not in context:
-                context['base_url'] = self.base_url
-
-            # Render HTML template
-            html = render_template(f'emails/{template_name}.html', **context)
-
-            # Render plain text template
-            text = render_template(f'emails/{template_name}.txt', **context)
+            text, html = self.render(template_name, context)
 
             # Send email
             return self.send(to_email, subject, text, html)
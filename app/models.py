@@ -1,7 +1,7 @@
 from datetime import datetime
 from app.database import Base
 from sqlalchemy.orm import relationship
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Index, JSON
 
 class User(Base):
     __tablename__ = "users"
@@ -13,8 +13,8 @@ class User(Base):
     email = Column(String, nullable=True)  # Email for sending results
     role = Column(String, nullable=False)  # "admin" or "user"
 
-    # Relationship to results
-    results = relationship("Result", back_populates="user")
+    # Relationship to results (removed by the database's ON DELETE CASCADE)
+    results = relationship("Result", back_populates="user", passive_deletes=True)
 
 class Quiz(Base):
     __tablename__ = "quizzes"
@@ -24,24 +24,33 @@ class Quiz(Base):
     filename = Column(String, unique=True, nullable=False)  # Stored in questions/ folder
     created_at = Column(DateTime, default=datetime.utcnow)
 
-    # Relationship to results
-    results = relationship("Result", back_populates="quiz")
+    # Relationship to results (removed by the database's ON DELETE CASCADE)
+    results = relationship("Result", back_populates="quiz", passive_deletes=True)
 
 class Result(Base):
     __tablename__ = "results"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    quiz_id = Column(Integer, ForeignKey("quizzes.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    quiz_id = Column(Integer, ForeignKey("quizzes.id", ondelete="CASCADE"), nullable=False)
     score = Column(Float, nullable=False)
+    attempt_number = Column(Integer, nullable=False)  # 1 for a user's first attempt at a quiz
     submitted_at = Column(DateTime, default=datetime.utcnow)
-    answers = Column(Text, nullable=False)  # Store as JSON string
+    answers = Column(JSON, nullable=False)  # Graded answers, stored as JSON text
     email_sent = Column(Boolean, default=False, nullable=False)  # Track if email was sent
 
     # Relationships
     user = relationship("User", back_populates="results")
     quiz = relationship("Quiz", back_populates="results")
 
+    # Attempt lookups filter on (user_id, quiz_id) and order by submitted_at;
+    # each attempt number can only be stored once, so concurrent duplicate
+    # submissions can't both be saved
+    __table_args__ = (
+        Index("ix_result_user_quiz_time", "user_id", "quiz_id", "submitted_at"),
+        Index("uq_result_user_quiz_attempt", "user_id", "quiz_id", "attempt_number", unique=True),
+    )
+
 class Settings(Base):
     __tablename__ = "settings"
 
@@ -0,0 +1,119 @@
+from datetime import datetime
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy.orm import defer, joinedload
+
+from app.config import Config
+from app.database import get_db
+from app.models import User, Quiz, Result
+from app.utils import is_smtp_enabled, get_max_attempts
+
+# Small per-process worker pool for slow background work (SMTP delivery),
+# so request handlers can return without waiting on the mail server.
+executor = ThreadPoolExecutor(max_workers=Config.EMAIL_WORKERS, thread_name_prefix="email")
+
+
+def enqueue(task, *args):
+    """Run a task in the background inside the current app's context.
+
+    The task gets its own DB session from get_db(), closed when the
+    context ends.
+    """
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                return task(*args)
+            except Exception as e:
+                print(f"❌ Background task {task.__name__} failed: {e}")
+
+    return executor.submit(run)
+
+
+def send_quiz_notifications(quiz_id: int):
+    """Email all students with an address about a newly uploaded quiz"""
+    db = get_db()
+    if not is_smtp_enabled(db):
+        return 0
+
+    quiz = db.get(Quiz, quiz_id)
+    if not quiz:
+        return 0
+
+    # Stream just the email addresses of students that have one, instead
+    # of loading every student as a full ORM object up front
+    emails = iter(db.query(User.email).filter(
+        User.role == "user",
+        User.email.isnot(None),
+        User.email != ""
+    ).yield_per(500))
+
+    first = next(emails, None)
+    if first is None:
+        print(f"No students with email addresses to notify about '{quiz.title}'")
+        return 0
+
+    # Every student receives the same message, so render it once
+    mailer = current_app.extensions['mailer']
+    subject = f"New Quiz Available: {quiz.title}"
+    text, html = mailer.render('student_quiz_reminder', {
+        'quiz_title': quiz.title,
+        'quiz_id': quiz.id,
+        'max_attempts': get_max_attempts(db),
+        'base_url': Config.BASE_URL
+    })
+
+    email_count = 0
+    student_count = 0
+    for (email,) in chain([first], emails):
+        student_count += 1
+        if mailer.send(email, subject, text, html):
+            email_count += 1
+
+    print(f"Quiz notifications for '{quiz.title}' sent to {email_count}/{student_count} student(s)")
+    return email_count
+
+
+def send_submission_notification(result_id: int, attempt_number: int, totals: dict):
+    """Email the admin about a student's quiz submission and flag it as sent"""
+    db = get_db()
+    if not is_smtp_enabled(db) or not Config.ADMIN_EMAIL:
+        return False
+
+    result = db.query(Result).options(
+        defer(Result.answers),
+        joinedload(Result.user),
+        joinedload(Result.quiz)
+    ).filter(Result.id == result_id).first()
+    if not result:
+        return False
+
+    user_name = result.user.user_id if result.user.user_id else result.user.username
+
+    mailer = current_app.extensions['mailer']
+    email_sent = mailer.send_template(
+        to_email=Config.ADMIN_EMAIL,
+        subject=f"Student Submission: {user_name} - {result.quiz.title}",
+        template_name='admin_submission_notification',
+        context={
+            'student_name': user_name,
+            'student_id': user_name,
+            'quiz_title': result.quiz.title,
+            'score': result.score,
+            'attempt_number': attempt_number,
+            'timestamp': datetime.now().strftime('%B %d, %Y at %I:%M %p'),
+            'passed': result.score >= 70,
+            'total_questions': totals['total_questions'],
+            'correct_count': totals['correct_count'],
+            'base_url': Config.BASE_URL
+        }
+    )
+
+    if email_sent:
+        result.email_sent = True
+        db.commit()
+        print(f"Admin notification sent for {user_name}'s submission of {result.quiz.title}")
+    return email_sent
@@ -1,19 +1,105 @@
 import os
-import re
-import json
+import hmac
+import orjson
+import time
+import secrets
+import threading
 
-from flask import session
+from typing import Optional
+from functools import lru_cache
+from collections import namedtuple, OrderedDict
+from flask import g, session, render_template, current_app
 from rapidfuzz import fuzz
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from app.models import User, Quiz, Settings
+from werkzeug.security import generate_password_hash, check_password_hash
+from app.config import Config
+from app.models import User, Quiz, Result, Settings
 
 # User helpers
+# The logged-in user is looked up on every request but rarely changes, so a
+# lightweight read-only copy (without the password) is cached per process
+# for USER_CACHE_TTL seconds, keeping at most USER_CACHE_SIZE recent users
+USER_CACHE_TTL = 60
+USER_CACHE_SIZE = 1024
+CurrentUser = namedtuple("CurrentUser", ["id", "username", "user_id", "email", "role"])
+_user_cache = OrderedDict()  # {user id: (expires_at, CurrentUser)}, least recently used first
+_user_cache_lock = threading.Lock()
+
+
 def get_current_user(db: Session):
-    """Get current user from session"""
-    user_id = session.get("user_id")
-    if user_id:
-        return db.query(User).filter(User.id == user_id).first()
-    return None
+    """Get current user from session, looked up at most once per request"""
+    if "current_user" not in g:
+        g.current_user = _load_current_user(db, session.get("user_id"))
+    return g.current_user
+
+
+def _load_current_user(db: Session, user_id):
+    """Get a user from the process cache, falling back to the database"""
+    if not user_id:
+        return None
+
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            _user_cache.move_to_end(user_id)
+            return cached[1]
+
+    user = db.get(User, user_id)
+    if not user:
+        clear_user_cache(user_id)
+        return None
+
+    current_user = CurrentUser(user.id, user.username, user.user_id, user.email, user.role)
+    with _user_cache_lock:
+        _user_cache[user_id] = (time.monotonic() + USER_CACHE_TTL, current_user)
+        _user_cache.move_to_end(user_id)
+        if len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+    return current_user
+
+
+def clear_user_cache(user_id: int):
+    """Drop a cached user so the next lookup comes from the database"""
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+
+
+# Password helpers
+PASSWORD_HASH_PREFIXES = ("scrypt:", "pbkdf2:")
+
+
+def hash_password(password: str) -> str:
+    """Hash a password for storage"""
+    return generate_password_hash(password)
+
+
+@lru_cache(maxsize=1)
+def _dummy_password_hash() -> str:
+    """Hash checked when there is no real one, so every failed login costs the same"""
+    return generate_password_hash(secrets.token_hex(16))
+
+
+def verify_password(user: Optional[User], password: str) -> bool:
+    """Check a password against the user's stored hash.
+
+    Unknown users (None) still go through a full hash check so response
+    time doesn't reveal which student IDs exist. Accounts created before
+    passwords were hashed still hold plaintext; those are compared in
+    constant time and rehashed on a successful login. The caller is
+    responsible for committing the session.
+    """
+    if user is None or not user.password:
+        check_password_hash(_dummy_password_hash(), password)
+        return False
+
+    if user.password.startswith(PASSWORD_HASH_PREFIXES):
+        return check_password_hash(user.password, password)
+
+    if not hmac.compare_digest(user.password.encode(), password.encode()):
+        return False
+    user.password = hash_password(password)
+    return True
 
 
 # Settings helpers
@@ -28,127 +114,227 @@ def get_or_create_settings(db: Session):
     return settings
 
 
+# Settings change rarely, so hot paths read them from a per-process cache
+# that is refreshed from the database at most every SETTINGS_CACHE_TTL seconds
+SETTINGS_CACHE_TTL = 30
+_settings_cache = None  # (expires_at, {setting: value})
+
+
+def get_cached_settings(db: Session) -> dict:
+    """Get settings values as a plain dict, cached for SETTINGS_CACHE_TTL seconds"""
+    global _settings_cache
+    cached = _settings_cache
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    # Read just the values with a Core select; no ORM object is built unless
+    # the settings row has to be created first
+    query = select(
+        Settings.max_attempts,
+        Settings.smtp_enabled,
+        Settings.full_page_submission
+    ).limit(1)
+    row = db.execute(query).first()
+    if row is None:
+        get_or_create_settings(db)
+        row = db.execute(query).first()
+
+    values = row._asdict()
+    _settings_cache = (time.monotonic() + SETTINGS_CACHE_TTL, values)
+    return values
+
+
+def clear_settings_cache():
+    """Drop cached settings so the next read comes from the database"""
+    global _settings_cache
+    _settings_cache = None
+
+
 def get_max_attempts(db: Session):
     """Get the maximum number of quiz attempts from settings"""
-    settings = get_or_create_settings(db)
-    return settings.max_attempts
+    return get_cached_settings(db)["max_attempts"]
 
 
 def is_smtp_enabled(db: Session):
     """Check if SMTP email sending is enabled"""
-    settings = get_or_create_settings(db)
-    return settings.smtp_enabled
+    return get_cached_settings(db)["smtp_enabled"]
+
+
+def is_full_page_submission(db: Session):
+    """Check if quizzes are submitted as a single page"""
+    return get_cached_settings(db)["full_page_submission"]
+
+
+# Page helpers
+# Pages shown to anonymous visitors look the same for everyone, so they are
+# rendered once per process and the HTML is reused (skipped in debug mode so
+# template edits still show up)
+_page_cache = {}
+
+
+def render_cached_template(template_name: str, **context) -> str:
+    """Render a visitor-independent template, reusing an earlier render"""
+    key = (template_name, tuple(sorted(context.items())))
+    html = _page_cache.get(key)
+    if html is None:
+        html = render_template(template_name, **context)
+        if not current_app.debug:
+            _page_cache[key] = html
+    return html
 
 
 # Text processing helpers
+# Built once at import: drops HTML brackets and turns hyphens, underscores
+# and other punctuation into spaces in a single str.translate() pass
+_NORMALIZE_TABLE = str.maketrans(
+    {c: ' ' for c in '-_.,;:!?(){}[]"/\\'} | {'<': None, '>': None}
+)
+
+
+# Correct answers come from the static quiz files and repeat on every
+# submission, so normalized strings are memoized
+@lru_cache(maxsize=4096)
 def normalize(text: str) -> str:
     """Normalize text for fuzzy matching"""
     if not text:
         return ""
-    
-    # Convert to lowercase
-    text = text.lower()
-    # Remove HTML brackets
-    text = re.sub(r'[<>]', '', text)
-    # Remove hyphens, underscores, and special characters
-    text = re.sub(r'[-_.,;:!?(){}\[\]"/\\]', ' ', text)
-    # Collapse multiple spaces into one
-    text = re.sub(r'\s+', ' ', text)
-    # Trim leading/trailing spaces
-    text = text.strip()
-    return text
+
+    # Lowercase, strip brackets and punctuation, then collapse runs of
+    # whitespace into single spaces (split() also trims the ends)
+    return ' '.join(text.lower().translate(_NORMALIZE_TABLE).split())
 
 
 def is_fuzzy_correct(user_answer: str, correct_answer: str, threshold: int = 85) -> bool:
     """Check if user answer is correct using fuzzy string matching"""
-    score = fuzz.ratio(normalize(user_answer), normalize(correct_answer))
+    user_answer = normalize(user_answer)
+    correct_answer = normalize(correct_answer)
+
+    # Identical answers always match; no need to run the fuzzy comparison
+    if user_answer == correct_answer:
+        return True
+
+    # ratio is 200 * matches / (len_a + len_b), so at best 200 * shorter / total;
+    # skip strings whose lengths alone already rule out the threshold
+    # (this also rejects a blank answer to a non-blank one)
+    shorter, longer = sorted((len(user_answer), len(correct_answer)))
+    if (200 - threshold) * shorter < threshold * longer:
+        return False
+
+    # With score_cutoff, rapidfuzz stops as soon as the threshold is out of reach
+    # and returns 0 instead of the exact score
+    score = fuzz.ratio(user_answer, correct_answer, score_cutoff=threshold)
     return score >= threshold
 
 
 # Quiz helpers
+def get_attempt_summary(db: Session, user_id: int, quiz_id: int):
+    """Get (attempt count, latest result id, latest submission time) for a user's quiz.
+
+    Result ids only grow, so the highest id is the latest attempt.
+    """
+    return db.query(
+        func.count(Result.id),
+        func.max(Result.id),
+        func.max(Result.submitted_at)
+    ).filter(
+        Result.user_id == user_id,
+        Result.quiz_id == quiz_id
+    ).one()
+
+
 def load_quiz_by_id(quiz_id: int, db: Session):
     """Load quiz data from database and JSON file"""
-    quiz = db.query(Quiz).filter(Quiz.id == quiz_id).first()
+    quiz = db.get(Quiz, quiz_id)
     if not quiz:
         return None, None
-    
-    # Updated path to new location
-    basedir = os.path.abspath(os.path.dirname(__file__))
-    quiz_path = os.path.join(basedir, 'data', 'questions', quiz.filename)
-    
-    if os.path.exists(quiz_path):
-        with open(quiz_path, "r", encoding="utf-8") as f:
-            quiz_data = json.load(f)
-            return quiz, quiz_data
-    return quiz, None
+    return quiz, load_quiz_file(quiz.filename)
+
+
+def load_quiz_file(filename: str):
+    """Load a quiz JSON file, or return None if it is missing"""
+    quiz_path = os.path.join(Config.QUESTIONS_DIR, filename)
+    try:
+        mtime = os.stat(quiz_path).st_mtime
+        return _parse_quiz_file(quiz_path, mtime)
+    except FileNotFoundError:
+        return None
+
+
+@lru_cache(maxsize=256)
+def _parse_quiz_file(quiz_path: str, mtime: float):
+    """Parse a quiz file, cached per (path, mtime).
+
+    Including the modification time in the key means an edited file is
+    parsed again. Callers must not modify the returned data.
+    """
+    with open(quiz_path, "rb") as f:
+        return orjson.loads(f.read())
 
 
 def calculate_score(exam_data, user_answers):
-    """Calculate score and prepare results"""
-    total_questions = 0
-    correct_answers = 0
-    results = {
-        "fill_in_the_blanks": [],
-        "true_false": [],
-        "mcqs": []
-    }
-    
-    # Process fill in the blanks
-    if "fill_in_the_blanks" in exam_data:
-        for idx, question in enumerate(exam_data["fill_in_the_blanks"]):
-            total_questions += 1
-            user_answer = user_answers.get(f"fib_{idx}", "").strip()
-            correct_answer = question["answer"].strip()
-            # Use fuzzy matching for flexible answer checking
-            is_correct = is_fuzzy_correct(user_answer, correct_answer)
-            if is_correct:
-                correct_answers += 1
-            results["fill_in_the_blanks"].append({
-                "question": question["question"],
-                "user_answer": user_answer,
-                "correct_answer": correct_answer,
-                "is_correct": is_correct
-            })
-    
+    """Calculate score and prepare results
+
+    Returns:
+        tuple: (percentage, results, totals) where totals holds
+        total_questions and correct_count
+    """
+    # Process fill in the blanks (fuzzy matched)
+    fill_in_the_blanks = []
+    for idx, question in enumerate(exam_data.get("fill_in_the_blanks", ())):
+        user_answer = user_answers.get(f"fib_{idx}", "").strip()
+        correct_answer = question["answer"].strip()
+        fill_in_the_blanks.append({
+            "question": question["question"],
+            "user_answer": user_answer,
+            "correct_answer": correct_answer,
+            "is_correct": is_fuzzy_correct(user_answer, correct_answer)
+        })
+
     # Process true/false
-    if "true_false" in exam_data:
-        for idx, question in enumerate(exam_data["true_false"]):
-            total_questions += 1
-            user_answer = user_answers.get(f"tf_{idx}")
-            if user_answer is not None:
-                user_answer = user_answer.lower() == "true"
-            correct_answer = question["answer"]
-            is_correct = user_answer == correct_answer
-            if is_correct:
-                correct_answers += 1
-            results["true_false"].append({
-                "question": question["question"],
-                "user_answer": user_answer,
-                "correct_answer": correct_answer,
-                "is_correct": is_correct
-            })
-    
+    true_false = []
+    for idx, question in enumerate(exam_data.get("true_false", ())):
+        user_answer = user_answers.get(f"tf_{idx}")
+        if user_answer is not None:
+            user_answer = user_answer.lower() == "true"
+        true_false.append({
+            "question": question["question"],
+            "user_answer": user_answer,
+            "correct_answer": question["answer"],
+            "is_correct": user_answer == question["answer"]
+        })
+
     # Process MCQs
-    if "mcqs" in exam_data:
-        for idx, question in enumerate(exam_data["mcqs"]):
-            total_questions += 1
-            user_answer = user_answers.get(f"mcq_{idx}", "")
-            correct_answer = question["answer"]
-            is_correct = user_answer == correct_answer
-            if is_correct:
-                correct_answers += 1
-            results["mcqs"].append({
-                "question": question["question"],
-                "options": question["options"],
-                "user_answer": user_answer,
-                "correct_answer": correct_answer,
-                "is_correct": is_correct
-            })
-    
+    mcqs = []
+    for idx, question in enumerate(exam_data.get("mcqs", ())):
+        user_answer = user_answers.get(f"mcq_{idx}", "")
+        mcqs.append({
+            "question": question["question"],
+            "options": question["options"],
+            "user_answer": user_answer,
+            "correct_answer": question["answer"],
+            "is_correct": user_answer == question["answer"]
+        })
+
+    results = {
+        "fill_in_the_blanks": fill_in_the_blanks,
+        "true_false": true_false,
+        "mcqs": mcqs
+    }
+
+    # Count everything in one pass once grading is done
+    total_questions = len(fill_in_the_blanks) + len(true_false) + len(mcqs)
+    correct_answers = sum(
+        item["is_correct"] for section in results.values() for item in section
+    )
+
     # Calculate percentage
     if total_questions > 0:
         percentage = (correct_answers / total_questions) * 100
     else:
         percentage = 0
-    
-    return percentage, results
+
+    totals = {
+        "total_questions": total_questions,
+        "correct_count": correct_answers
+    }
+    return percentage, results, totals
@@ -0,0 +1,20 @@
+"""
+Gunicorn configuration, loaded automatically by `gunicorn run:app`
+
+Requests spend most of their time waiting on SQLite and SMTP rather than
+on the CPU, so each worker process serves several requests at once on
+threads (gthread) instead of one at a time (sync).
+"""
+
+import os
+import multiprocessing
+
+# run.py reads this when workers load the app; set FLASK_CONFIG to override
+os.environ.setdefault("FLASK_CONFIG", "production")
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8080")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 4))  # Concurrent requests per worker
+timeout = 60
+keepalive = 5
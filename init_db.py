@@ -7,24 +7,24 @@ Usage:
     python init_db.py
 """
 
-from app import create_app
-from app.database import Base, engine
-from app.models import User, Quiz, Result, Settings
+from app.database import init_db
 
 def init_database():
     """Initialize the database by creating all tables"""
     print("Initializing database...")
 
     # Create all tables
-    Base.metadata.create_all(bind=engine)
+    init_db()
 
-    print("✅ Database tables created successfully!")
-    print("\nCreated tables:")
-    print("  - users")
-    print("  - quizzes")
-    print("  - results")
-    print("  - settings")
-    print("\nDatabase location: instance/quiz_app.db")
+    print(
+        "✅ Database tables created successfully!\n"
+        "\nCreated tables:\n"
+        "  - users\n"
+        "  - quizzes\n"
+        "  - results\n"
+        "  - settings\n"
+        "\nDatabase location: instance/quiz_app.db"
+    )
 
 if __name__ == "__main__":
     init_database()
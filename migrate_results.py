@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Results Table Migration Script
+Brings an existing `results` table in line with the Result model:
+  - an attempt_number column, numbered from existing submissions
+    (including rows a previous run left without a number)
+  - foreign keys to users/quizzes use ON DELETE CASCADE
+  - all model indexes exist
+
+Everything runs in one transaction, so a failed run leaves the table as
+it was. Safe to run more than once.
+
+Usage:
+    python migrate_results.py
+"""
+
+from app.database import engine
+from app.models import Result
+
+
+def add_attempt_number_column(conn):
+    """Add the `attempt_number` column; number_attempts() fills it in"""
+    conn.exec_driver_sql("ALTER TABLE results ADD COLUMN attempt_number INTEGER")
+
+
+def number_attempts(conn):
+    """Number each user's attempts at a quiz in submission order, for rows without a number"""
+    conn.exec_driver_sql("""
+        UPDATE results SET attempt_number = (
+            SELECT numbered.attempt_number FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY user_id, quiz_id ORDER BY submitted_at, id
+                ) AS attempt_number
+                FROM results
+            ) AS numbered
+            WHERE numbered.id = results.id
+        )
+        WHERE attempt_number IS NULL
+    """)
+
+
+def has_cascading_foreign_keys(conn):
+    """Check whether every foreign key on `results` cascades on delete"""
+    foreign_keys = conn.exec_driver_sql("PRAGMA foreign_key_list(results)").fetchall()
+    # Row layout: (id, seq, table, from, to, on_update, on_delete, match)
+    return all(fk[6] == "CASCADE" for fk in foreign_keys)
+
+
+def rebuild_results_table(conn):
+    """Recreate `results` from the model definition, keeping all rows.
+
+    SQLite can't alter foreign keys in place, so the table is renamed,
+    recreated and refilled.
+    """
+    old_columns = [row[1] for row in conn.exec_driver_sql("PRAGMA table_info(results)")]
+    columns = ", ".join(c.name for c in Result.__table__.columns if c.name in old_columns)
+
+    conn.exec_driver_sql("ALTER TABLE results RENAME TO results_old")
+
+    # Indexes keep their names when a table is renamed; drop them so the
+    # new table can recreate them
+    old_indexes = conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'results_old' AND sql IS NOT NULL"
+    ).fetchall()
+    for (index_name,) in old_indexes:
+        conn.exec_driver_sql(f'DROP INDEX "{index_name}"')
+
+    Result.__table__.create(conn)
+    conn.exec_driver_sql(f"INSERT INTO results ({columns}) SELECT {columns} FROM results_old")
+    conn.exec_driver_sql("DROP TABLE results_old")
+
+
+def delete_orphaned_results(conn):
+    """Delete results whose user or quiz no longer exists.
+
+    Foreign keys were not enforced before, so older databases can hold
+    results left behind by deleted users or quizzes.
+    """
+    orphans = conn.exec_driver_sql("PRAGMA foreign_key_check(results)").fetchall()
+    # Row layout: (table, rowid, parent table, foreign key id)
+    orphan_ids = sorted({row[1] for row in orphans})
+    for result_id in orphan_ids:
+        conn.exec_driver_sql("DELETE FROM results WHERE rowid = ?", (result_id,))
+    return orphan_ids
+
+
+def migrate():
+    print(f"Connecting to database: {engine.url}")
+
+    # pysqlite commits DDL (ALTER/RENAME/CREATE/DROP) on its own, so take
+    # over transaction control and wrap every step in one explicit BEGIN
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+
+        if not engine.dialect.has_table(conn, "results"):
+            print("Table 'results' does not exist yet - run init_db.py instead.")
+            return
+        if engine.dialect.has_table(conn, "results_old"):
+            raise RuntimeError(
+                "Table 'results_old' exists from an interrupted migration; "
+                "restore it to 'results' before running this again."
+            )
+
+        # Foreign keys can only be switched outside a transaction. They stay
+        # off while rows are copied and are checked explicitly before commit.
+        conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        conn.exec_driver_sql("BEGIN")
+        try:
+            columns = [row[1] for row in conn.exec_driver_sql("PRAGMA table_info(results)")]
+            if "attempt_number" in columns:
+                print("Column 'attempt_number' already exists.")
+            else:
+                print("Adding 'attempt_number' column...")
+                add_attempt_number_column(conn)
+
+            # Also covers a column left unfilled by an earlier, interrupted run
+            unnumbered = conn.exec_driver_sql(
+                "SELECT COUNT(*) FROM results WHERE attempt_number IS NULL"
+            ).scalar()
+            if unnumbered:
+                print(f"Numbering {unnumbered} existing attempt(s)...")
+                number_attempts(conn)
+
+            if has_cascading_foreign_keys(conn):
+                print("Foreign keys on 'results' already cascade on delete.")
+            else:
+                print("Rebuilding 'results' table with ON DELETE CASCADE foreign keys...")
+                rebuild_results_table(conn)
+
+            # Create any indexes declared on the model that are missing
+            for index in Result.__table__.indexes:
+                index.create(conn, checkfirst=True)
+
+            orphan_ids = delete_orphaned_results(conn)
+            if orphan_ids:
+                print(f"Deleted {len(orphan_ids)} result(s) of deleted users or quizzes: {orphan_ids}")
+
+            conn.exec_driver_sql("COMMIT")
+        except Exception:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+        finally:
+            conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+
+    print("Migration successful!")
+
+
+if __name__ == "__main__":
+    try:
+        migrate()
+    except Exception as e:
+        print(f"Error during migration: {str(e)}")
+        exit(1)
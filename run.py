@@ -1,7 +1,10 @@
 #!/usr/bin/env python
+import os
 from app import create_app
 
-app = create_app()
+# FLASK_CONFIG selects the configuration: 'development' by default,
+# 'production' under Gunicorn (set in gunicorn.conf.py)
+app = create_app(os.getenv("FLASK_CONFIG", "default"))
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    app.run(host='0.0.0.0', port=8080, debug=app.debug)